@@ -14,44 +14,65 @@ Usage:
     python backup.py --list             List existing backups
 """
 
+import functools
+import gzip
 import os
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 from datetime import datetime, timedelta
 from collections import defaultdict
 
-from config import get_app_names, get_app_config, APPS, BACKUPS_DIR, SERVER_USER, SERVER_IP, SSH_OPTIONS
-from ssh_utils import check_prerequisites, test_ssh_connection, run_ssh_quiet, _ssh_key
+from config import get_app_names, get_app_config, APPS, BACKUPS_DIR, SERVER_USER, SERVER_IP
+from ssh_utils import (
+    check_prerequisites, test_ssh_connection, run_ssh_quiet, run_parallel,
+    _scp_base, _ssh_base,
+)
+
+# Backup filenames end in .yyyy-mm-dd
+_DATE_RE = re.compile(r'\.(\d{4}-\d{2}-\d{2})$')
 
 
 def parse_backup_date(filename):
     """Extract date from backup filename like 'database.db.2026-02-05'."""
-    match = re.search(r'\.(\d{4}-\d{2}-\d{2})$', filename)
+    match = _DATE_RE.search(filename)
     if match:
         return datetime.strptime(match.group(1), "%Y-%m-%d").date()
     return None
 
 
+@functools.lru_cache(maxsize=None)
+def app_backup_dir(app_name):
+    """Local backup directory for an app."""
+    return os.path.join(BACKUPS_DIR, app_name)
+
+
 def get_existing_backups(app_name):
-    """Get list of existing backups for an app, sorted newest first."""
-    app_dir = os.path.join(BACKUPS_DIR, app_name)
+    """
+    Get list of existing backups for an app, sorted newest first.
+
+    Returns (filename, date, path, size_bytes) tuples.
+    """
+    app_dir = app_backup_dir(app_name)
     if not os.path.exists(app_dir):
         return []
 
     backups = []
-    for f in os.listdir(app_dir):
-        date = parse_backup_date(f)
-        if date:
-            path = os.path.join(app_dir, f)
-            backups.append((f, date, path))
+    with os.scandir(app_dir) as entries:
+        for entry in entries:
+            date = parse_backup_date(entry.name)
+            if date:
+                backups.append((entry.name, date, entry.path, entry.stat().st_size))
 
     # Sort by date, newest first
     backups.sort(key=lambda x: x[1], reverse=True)
     return backups
 
 
-def should_backup(app_name, force=False):
+def should_backup(app_name, force=False, today=None):
     """Check if we should backup (newest backup > 7 days old)."""
     if force:
         return True
@@ -61,7 +82,7 @@ def should_backup(app_name, force=False):
         return True
 
     newest_date = backups[0][1]
-    days_old = (datetime.now().date() - newest_date).days
+    days_old = ((today or datetime.now().date()) - newest_date).days
 
     if days_old <= 7:
         print(f"  Skipping: latest backup is {days_old} days old (threshold: 7)")
@@ -70,7 +91,7 @@ def should_backup(app_name, force=False):
     return True
 
 
-def rotate_backups(app_name):
+def rotate_backups(app_name, today=None):
     """
     Apply rotation policy:
     - Keep last 4 backups (weekly)
@@ -84,17 +105,17 @@ def rotate_backups(app_name):
     to_delete = []
 
     # Keep the 4 most recent
-    for f, date, path in backups[:4]:
+    for f, date, path, size in backups[:4]:
         to_keep.add(path)
 
     # Group remaining by month
     monthly = defaultdict(list)
-    for f, date, path in backups[4:]:
+    for f, date, path, size in backups[4:]:
         month_key = (date.year, date.month)
         monthly[month_key].append((f, date, path))
 
     # Keep oldest backup from each month (up to 12 months)
-    cutoff = datetime.now().date() - timedelta(days=365)
+    cutoff = (today or datetime.now().date()) - timedelta(days=365)
     months_kept = 0
 
     for month_key in sorted(monthly.keys(), reverse=True):
@@ -110,7 +131,7 @@ def rotate_backups(app_name):
             months_kept += 1
 
     # Delete anything not in to_keep
-    for f, date, path in backups:
+    for f, date, path, size in backups:
         if path not in to_keep:
             to_delete.append((f, path))
 
@@ -121,29 +142,35 @@ def rotate_backups(app_name):
             os.remove(path)
 
 
-def list_backups():
+def list_backups(today=None):
     """List all existing backups."""
     if not os.path.exists(BACKUPS_DIR):
         print("No backups directory found.")
         return
 
     print(f"\nBackups in: {BACKUPS_DIR}\n")
+    today = today or datetime.now().date()
 
     for app_name in APPS.keys():
         backups = get_existing_backups(app_name)
         if backups:
             print(f"  {app_name}: ({len(backups)} backups)")
-            for f, date, path in backups[:5]:
-                size_kb = os.path.getsize(path) / 1024
-                days_ago = (datetime.now().date() - date).days
+            for f, date, path, size in backups[:5]:
+                size_kb = size / 1024
+                days_ago = (today - date).days
                 print(f"    {f} ({size_kb:.1f} KB, {days_ago}d ago)")
             if len(backups) > 5:
                 print(f"    ... and {len(backups) - 5} more")
             print()
 
 
-def backup_app(app_name, force=False):
-    """Backup database for a single application."""
+def prepare_backup(app_name, force=False, today=None):
+    """
+    Run the pre-download checks for one application.
+
+    Returns (db_path, local_path, remote_size) if the database should be
+    downloaded, None if the app is skipped, or False on failure.
+    """
     config = get_app_config(app_name)
     db_path = config.get("db_remote_path")
 
@@ -155,62 +182,174 @@ def backup_app(app_name, force=False):
     print(f"  {'-'*40}")
 
     # Check if backup needed
-    if not should_backup(app_name, force):
+    today = today or datetime.now().date()
+    if not should_backup(app_name, force, today):
         return None
 
-    # Check if remote db exists
-    stdout, stderr, rc = run_ssh_quiet(f"test -f {db_path} && echo exists")
-    if stdout != "exists":
+    # Check remote db exists and get its size in one round-trip
+    stdout, stderr, rc = run_ssh_quiet(
+        f"if [ -f {db_path} ]; then "
+        f"stat -c%s {db_path} 2>/dev/null || stat -f%z {db_path} 2>/dev/null; "
+        f"else echo MISSING; fi"
+    )
+    if stdout == "MISSING" or (rc != 0 and not stdout):
         print(f"  WARNING: Database file not found on server")
         return False
 
-    # Get remote file size
-    stdout, _, _ = run_ssh_quiet(f"stat -c%s {db_path} 2>/dev/null || stat -f%z {db_path} 2>/dev/null")
     remote_size = int(stdout) if stdout.isdigit() else 0
     print(f"  Remote: {db_path} ({remote_size / 1024:.1f} KB)")
 
     # Create backup directory
-    app_backup_dir = os.path.join(BACKUPS_DIR, app_name)
-    os.makedirs(app_backup_dir, exist_ok=True)
+    backup_dir = app_backup_dir(app_name)
+    os.makedirs(backup_dir, exist_ok=True)
 
     # Generate backup filename: name.db.yyyy-mm-dd
-    today = datetime.now().strftime("%Y-%m-%d")
     db_filename = os.path.basename(db_path)
-    backup_filename = f"{db_filename}.{today}"
-    local_path = os.path.join(app_backup_dir, backup_filename)
+    backup_filename = f"{db_filename}.{today:%Y-%m-%d}"
+    local_path = os.path.join(backup_dir, backup_filename)
 
     # Check if today's backup already exists
     if os.path.exists(local_path):
         print(f"  Backup for today already exists: {backup_filename}")
         return None
 
-    # Download via SCP
-    print(f"  Downloading...")
-    scp_cmd = [
-        "scp", "-i", _ssh_key(),
-    ] + SSH_OPTIONS + [
-        f"{SERVER_USER}@{SERVER_IP}:{db_path}",
-        local_path,
-    ]
+    return db_path, local_path, remote_size
 
-    result = subprocess.run(scp_cmd, capture_output=True, text=True, timeout=60)
 
-    if result.returncode != 0:
-        print(f"  FAILED: {result.stderr.strip()}")
+def download_compressed(app_name, db_path, local_path):
+    """
+    Download a database gzip-compressed over SSH, decompressing as it arrives.
+
+    Used for apps with "backup_compress" set; SQLite files compress well, so
+    this cuts transfer time on slow links. The saved file is a plain copy,
+    same as an scp download.
+    """
+    print(f"\n  Downloading {app_name} (compressed)...")
+    partial_path = local_path + ".part"
+    # stderr goes to a file so a chatty remote gzip can't fill a pipe and stall
+    with tempfile.TemporaryFile() as stderr:
+        ssh = subprocess.Popen(
+            _ssh_base() + [f"gzip -1 -c {db_path}"],
+            stdout=subprocess.PIPE, stderr=stderr,
+        )
+        # Same 60s limit as an scp download; a stalled link would otherwise
+        # block the copy below forever
+        expired = threading.Event()
+        watchdog = threading.Timer(60, lambda: (expired.set(), ssh.kill()))
+        watchdog.start()
+        try:
+            with open(partial_path, "wb") as out, gzip.GzipFile(fileobj=ssh.stdout) as gz:
+                shutil.copyfileobj(gz, out)
+            ssh.wait()
+            ok = ssh.returncode == 0 and not expired.is_set()
+            error = ""
+        except (OSError, EOFError) as e:
+            ssh.kill()
+            ssh.wait()
+            ok, error = False, str(e)
+        finally:
+            watchdog.cancel()
+            ssh.stdout.close()
+
+        if expired.is_set():
+            error = "download timed out"
+        elif not ok and not error:
+            stderr.seek(0)
+            error = stderr.read().decode(errors="replace")
+
+    if not ok:
+        print(f"  FAILED: {error.strip()}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
         return False
 
-    # Verify local file
-    if os.path.exists(local_path):
-        local_size = os.path.getsize(local_path)
-        print(f"  Saved: {backup_filename} ({local_size / 1024:.1f} KB)")
+    os.replace(partial_path, local_path)
+    return True
 
-        # Apply rotation
-        rotate_backups(app_name)
-        return True
-    else:
-        print(f"  FAILED: File not created")
+
+def download_backups(downloads):
+    """
+    Download databases with as few SCP sessions as possible.
+
+    downloads maps app_name -> (db_path, local_path, remote_size). Files are
+    fetched into a staging directory with one scp per batch of distinct
+    basenames, then moved to their final names. Apps with "backup_compress"
+    set are fetched with download_compressed() instead. Returns
+    {app_name: True/False}.
+    """
+    results = {}
+
+    # Group into batches whose remote basenames don't collide in staging
+    batches = []
+    for app_name, (db_path, local_path, remote_size) in downloads.items():
+        if get_app_config(app_name).get("backup_compress"):
+            results[app_name] = download_compressed(app_name, db_path, local_path)
+            continue
+        basename = os.path.basename(db_path)
+        for batch in batches:
+            if basename not in batch:
+                batch[basename] = app_name
+                break
+        else:
+            batches.append({basename: app_name})
+
+    if not batches:
+        return results
+
+    os.makedirs(BACKUPS_DIR, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix=".download-", dir=BACKUPS_DIR)
+    try:
+        for batch in batches:
+            print(f"\n  Downloading {len(batch)} database(s)...")
+            sources = [
+                f"{SERVER_USER}@{SERVER_IP}:{downloads[app_name][0]}"
+                for app_name in batch.values()
+            ]
+            try:
+                result = subprocess.run(
+                    _scp_base() + sources + [staging_dir],
+                    capture_output=True, text=True, timeout=60 * len(sources),
+                )
+            except subprocess.TimeoutExpired:
+                print("  FAILED: scp timed out")
+                for app_name in batch.values():
+                    results[app_name] = False
+                continue
+            failed = result.returncode != 0
+            if failed:
+                print(f"  FAILED: {result.stderr.strip()}")
+
+            # scp may fail part-way, leaving missing or truncated files, so
+            # after a failure only keep files whose size matches the server's
+            for basename, app_name in batch.items():
+                staged = os.path.join(staging_dir, basename)
+                db_path, local_path, remote_size = downloads[app_name]
+                ok = os.path.exists(staged) and (
+                    not failed or os.path.getsize(staged) == remote_size
+                )
+                if ok:
+                    os.replace(staged, local_path)
+                results[app_name] = ok
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return results
+
+
+def finish_backup(app_name, local_path, today=None):
+    """Verify a downloaded backup and apply rotation."""
+    backup_filename = os.path.basename(local_path)
+    if not os.path.exists(local_path):
+        print(f"  {app_name}: FAILED: File not created")
         return False
 
+    local_size = os.path.getsize(local_path)
+    print(f"  {app_name}: Saved {backup_filename} ({local_size / 1024:.1f} KB)")
+
+    # Apply rotation
+    rotate_backups(app_name, today)
+    return True
+
 
 def main():
     if len(sys.argv) < 2:
@@ -238,13 +377,16 @@ def main():
     if not test_ssh_connection():
         sys.exit(1)
 
-    results = {}
-    for name in app_names:
-        try:
-            results[name] = backup_app(name, force)
-        except Exception as e:
-            print(f"\n  ERROR backing up {name}: {e}")
-            results[name] = False
+    # Checks run per app; downloads are batched into a single SCP session
+    today = datetime.now().date()
+    results = run_parallel(prepare_backup, app_names, force, today, action="backing up")
+    downloads = {
+        name: plan for name, plan in results.items() if isinstance(plan, tuple)
+    }
+    if downloads:
+        downloaded = download_backups(downloads)
+        for name, (db_path, local_path, remote_size) in downloads.items():
+            results[name] = downloaded[name] and finish_backup(name, local_path, today)
 
     # Summary
     print(f"\n{'='*40}")
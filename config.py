@@ -3,9 +3,11 @@ Deployment Manager - Configuration
 App definitions, shared constants, and helper functions.
 """
 
+import functools
 import glob
 import os
 import sys
+from pathlib import Path
 
 # Server settings
 SERVER_USER = "ec2-user"
@@ -17,13 +19,30 @@ SSH_OPTIONS = [
     "-o", "ConnectTimeout=10",
 ]
 
+# SSH connection sharing: one background master connection is opened per run
+# and every later ssh/scp call is multiplexed over it (not supported on Windows)
+SSH_CONTROL_PATH = "~/.ssh/cm-%r@%h:%p"
+SSH_CONTROL_PERSIST = "10m"
+
+# Maximum number of apps processed concurrently by multi-app commands
+MAX_PARALLEL_APPS = 8
+
+# Maximum number of ssh/scp sessions open at once. Multiplexed sessions count
+# against sshd's MaxSessions (default 10); set DM_SSH_CONCURRENCY to match it
+SSH_CONCURRENCY = max(1, int(os.environ.get("DM_SSH_CONCURRENCY", "10")))
+
 # Base paths
 DEPLOYMENT_MANAGER_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECTS_DIR = os.path.dirname(DEPLOYMENT_MANAGER_DIR)  # C:\claude_projects
+PROJECTS_PATH = Path(PROJECTS_DIR)
 
 
+@functools.lru_cache(maxsize=1)
 def find_ssh_key():
-    """Find SSH key, checking deployment-manager dir first, then taskschedule dir."""
+    """Find SSH key, checking deployment-manager dir first, then taskschedule dir.
+
+    The result is cached, since every ssh/scp call looks up the key.
+    """
     # Check deployment-manager directory
     pem_files = glob.glob(os.path.join(DEPLOYMENT_MANAGER_DIR, "*.pem"))
     if pem_files:
@@ -40,7 +59,7 @@ def find_ssh_key():
 # App configurations
 APPS = {
     "taskschedule": {
-        "local_path": os.path.join(PROJECTS_DIR, "taskschedule"),
+        "local_path": PROJECTS_PATH / "taskschedule",
         "remote_path": "/home/ec2-user/taskschedule",
         "service_name": "taskschedule",
         "port": 5000,
@@ -57,7 +76,7 @@ APPS = {
         "dep_install": "python3 -m pip install -r requirements.txt",
     },
     "sevenhabitslist": {
-        "local_path": os.path.join(PROJECTS_DIR, "sevenhabitslist"),
+        "local_path": PROJECTS_PATH / "sevenhabitslist",
         "remote_path": "/home/ec2-user/sevenhabitslist",
         "service_name": "sevenhabitslist",
         "port": 3002,
@@ -73,7 +92,7 @@ APPS = {
         "dep_install": "source venv/bin/activate && pip install -r requirements.txt",
     },
     "recipeshoppinglist": {
-        "local_path": os.path.join(PROJECTS_DIR, "recipeshoppinglist"),
+        "local_path": PROJECTS_PATH / "recipeshoppinglist",
         "remote_path": "/home/ec2-user/recipeshoppinglist",
         "service_name": "recipeshoppinglist",
         "port": 3003,
@@ -88,13 +107,14 @@ APPS = {
         "dep_install": "python3 -m pip install -r requirements.txt",
     },
     "tifootball": {
-        "local_path": os.path.join(PROJECTS_DIR, "tifootball"),
+        "local_path": PROJECTS_PATH / "tifootball",
         "remote_path": "/home/ec2-user/tifootball",
         "service_name": "tifootball",
         "port": 3001,
         "url": "https://tifootball.mebbert.com",
         "stack": "node",
         "db_remote_path": "/home/ec2-user/tifootball/data/tifootball.db",
+        "backup_compress": True,  # gzip over SSH instead of plain scp
         "exclude_patterns": [
             "node_modules/", ".git/", "client/src/",
             "*.db", "*.db-journal", "*.sqlite", "*.sqlite3", ".DS_Store",
@@ -110,7 +130,7 @@ APPS = {
         "dep_install": "cd server && npm install",
     },
     "rjbingo": {
-        "local_path": os.path.join(PROJECTS_DIR, "rjbingo"),
+        "local_path": PROJECTS_PATH / "rjbingo",
         "remote_path": "/home/ec2-user/rjbingo",
         "service_name": "rjbingo",
         "port": 5001,
@@ -126,7 +146,7 @@ APPS = {
         "dep_install": "python3 -m pip install -r requirements.txt",
     },
     "collinsworthbingo": {
-        "local_path": os.path.join(PROJECTS_DIR, "collinsworthbingo"),
+        "local_path": PROJECTS_PATH / "collinsworthbingo",
         "remote_path": "/home/ec2-user/collinsworthbingo",
         "service_name": "collinsworthbingo",
         "port": 5002,
@@ -143,6 +163,11 @@ APPS = {
 # Backup settings
 BACKUPS_DIR = os.path.join(DEPLOYMENT_MANAGER_DIR, "backups")
 
+# Status probe cache (only used with status.py --ttl)
+STATUS_CACHE_FILE = os.path.join(
+    os.path.expanduser("~"), ".cache", "deployment-manager", "status.json",
+)
+
 
 def get_app_config(name):
     """Get config for a single app by name."""
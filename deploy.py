@@ -7,14 +7,13 @@ Usage:
     python deploy.py <app> --yes      Skip confirmation prompt
 """
 
-import os
+import shlex
 import sys
-import time
 
 from config import get_app_names, get_app_config
 from ssh_utils import (
     check_prerequisites, test_ssh_connection, run_local,
-    run_ssh, run_ssh_quiet, sync_files,
+    run_ssh, run_parallel, restart_service, sync_files,
 )
 
 
@@ -28,9 +27,9 @@ def deploy_app(app_name):
 
     # Pre-sync commands (e.g., npm build for tifootball)
     for cmd_info in config.get("pre_sync_commands", []):
-        cwd = os.path.join(config["local_path"], cmd_info.get("cwd_suffix", ""))
+        cwd = config["local_path"] / cmd_info.get("cwd_suffix", "")
         result = run_local(
-            cmd_info["cmd"],
+            shlex.split(cmd_info["cmd"]),
             description=cmd_info.get("description", cmd_info["cmd"]),
             check=True,
             cwd=cwd,
@@ -54,21 +53,11 @@ def deploy_app(app_name):
     if result.returncode != 0:
         print(f"  WARNING: Dependency install had issues (exit code {result.returncode})")
 
-    # Restart service
+    # Restart service and wait for it to settle
     print("\n  [Restarting service]")
-    run_ssh(
-        f"sudo systemctl restart {config['service_name']}",
-        description=f"Restarting {config['service_name']}",
-        check=False,
-    )
-
-    # Wait and verify
-    print("  Waiting for service to start...")
-    time.sleep(2)
+    print(f"  Restarting {config['service_name']}...")
+    stdout = restart_service(config["service_name"])
 
-    stdout, _, rc = run_ssh_quiet(
-        f"systemctl is-active {config['service_name']}"
-    )
     if stdout == "active":
         print(f"  Service {config['service_name']}: ACTIVE")
         return True
@@ -110,13 +99,7 @@ def main():
             sys.exit(0)
 
     # Deploy each app
-    results = {}
-    for name in app_names:
-        try:
-            results[name] = deploy_app(name)
-        except Exception as e:
-            print(f"\n  ERROR deploying {name}: {e}")
-            results[name] = False
+    results = run_parallel(deploy_app, app_names, action="deploying")
 
     # Summary
     print(f"\n{'='*60}")
@@ -7,6 +7,7 @@ Usage:
     python logs.py <app> -n 100             Last 100 lines
     python logs.py <app> -f                 Follow real-time
     python logs.py <app> --since "1 hour ago"
+    python logs.py <app> -v                 Full journal format (timestamp, host, PID)
 """
 
 import sys
@@ -17,7 +18,7 @@ from ssh_utils import check_prerequisites, test_ssh_connection, run_ssh, run_ssh
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python logs.py <app> [-f] [-n LINES] [--since TIME]")
+        print("Usage: python logs.py <app> [-f] [-n LINES] [--since TIME] [-v]")
         print(f"Apps: {', '.join(APPS.keys())}")
         print("\nNote: Only single app supported (no 'all')")
         sys.exit(1)
@@ -33,6 +34,7 @@ def main():
 
     # Parse flags
     follow = "-f" in sys.argv or "--follow" in sys.argv
+    verbose = "-v" in sys.argv or "--verbose" in sys.argv
     lines = 50
     since = None
 
@@ -63,6 +65,10 @@ def main():
     if since:
         cmd += f' --since "{since}"'
 
+    # Message text only unless --verbose; cuts bytes per line over SSH
+    if not verbose:
+        cmd += " --output=cat"
+
     if follow:
         cmd += f" -n {lines} -f"
         print(f"\n  Following logs for {app_name} (Ctrl+C to stop)...\n")
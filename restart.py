@@ -7,10 +7,11 @@ Usage:
 """
 
 import sys
-import time
 
 from config import get_app_names, get_app_config
-from ssh_utils import check_prerequisites, test_ssh_connection, run_ssh, run_ssh_quiet
+from ssh_utils import (
+    check_prerequisites, test_ssh_connection, run_ssh, run_parallel, restart_service,
+)
 
 
 def restart_app(app_name):
@@ -20,12 +21,8 @@ def restart_app(app_name):
 
     print(f"\n  Restarting {app_name} ({service})...")
 
-    # Restart
-    run_ssh(f"sudo systemctl restart {service}", check=False)
-
-    # Wait and verify
-    time.sleep(2)
-    stdout, _, rc = run_ssh_quiet(f"systemctl is-active {service}")
+    # Restart and wait for the service to settle
+    stdout = restart_service(service)
 
     if stdout == "active":
         print(f"  [OK] {app_name}: active")
@@ -57,13 +54,7 @@ def main():
     if not test_ssh_connection():
         sys.exit(1)
 
-    results = {}
-    for name in app_names:
-        try:
-            results[name] = restart_app(name)
-        except Exception as e:
-            print(f"\n  ERROR restarting {name}: {e}")
-            results[name] = False
+    results = run_parallel(restart_app, app_names, action="restarting")
 
     # Summary
     print(f"\n{'='*40}")
@@ -3,15 +3,36 @@ Deployment Manager - SSH/SCP/Tar Utilities
 Shared functions for remote operations using scp/ssh (no rsync required).
 """
 
+import atexit
 import fnmatch
+import functools
+import io
 import os
+import re
+import shlex
 import shutil
 import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from config import SERVER_USER, SERVER_IP, SSH_OPTIONS, find_ssh_key
+from config import (
+    SERVER_USER, SERVER_IP, SSH_OPTIONS, SSH_CONTROL_PATH, SSH_CONTROL_PERSIST,
+    MAX_PARALLEL_APPS, SSH_CONCURRENCY, find_ssh_key,
+)
+
+# OpenSSH for Windows does not support ControlMaster sockets
+_MULTIPLEX = os.name != "nt"
+_master_open = False  # only set for a master this process started
+
+# Bounds concurrent SSH sessions so parallel apps stay under sshd's limits
+_ssh_slots = threading.Semaphore(SSH_CONCURRENCY)
+
+# Per-thread output buffers used by run_parallel()
+_thread_output = threading.local()
+_output_lock = threading.Lock()
 
 
 def _ssh_key():
@@ -24,14 +45,114 @@ def _ssh_key():
     return key
 
 
+def _control_options():
+    """Return SSH options that reuse the shared master connection, if any.
+
+    Clients only set ControlPath (not ControlMaster=auto): if the master is
+    gone they fall back to a direct connection instead of becoming a new
+    persistent master that would hold our captured stdout/stderr pipes open.
+    """
+    if not _MULTIPLEX:
+        return []
+    return ["-o", f"ControlPath={SSH_CONTROL_PATH}"]
+
+
+@functools.lru_cache(maxsize=None)
+def _ssh_argv():
+    """Build the SSH argv prefix once per process."""
+    return (
+        "ssh", "-i", _ssh_key(), *SSH_OPTIONS, *_control_options(),
+        f"{SERVER_USER}@{SERVER_IP}",
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _scp_argv():
+    """Build the SCP argv prefix once per process."""
+    return ("scp", "-i", _ssh_key(), *SSH_OPTIONS, *_control_options())
+
+
 def _ssh_base():
     """Return base SSH command parts."""
-    return ["ssh", "-i", _ssh_key()] + SSH_OPTIONS + [f"{SERVER_USER}@{SERVER_IP}"]
+    return list(_ssh_argv())
 
 
 def _scp_base():
     """Return base SCP command parts."""
-    return ["scp", "-i", _ssh_key()] + SSH_OPTIONS
+    return list(_scp_argv())
+
+
+def _master_alive():
+    """Check whether a master is already listening on the control socket."""
+    try:
+        result = subprocess.run(
+            ["ssh", "-o", f"ControlPath={SSH_CONTROL_PATH}", "-O", "check",
+             f"{SERVER_USER}@{SERVER_IP}"],
+            capture_output=True, timeout=10,
+        )
+    except subprocess.TimeoutExpired:
+        return False
+    return result.returncode == 0
+
+
+def open_ssh_master():
+    """
+    Open a background master connection shared by later ssh/scp calls.
+
+    A live master left by another run (e.g. a status poller during a deploy)
+    is reused as-is; only a master opened here is stopped at exit.
+    """
+    global _master_open
+    if not _MULTIPLEX or _master_open:
+        return _master_open
+
+    # The control socket lives in a private directory, not world-writable /tmp
+    control_dir = os.path.dirname(os.path.expanduser(SSH_CONTROL_PATH))
+    os.makedirs(control_dir, mode=0o700, exist_ok=True)
+
+    if _master_alive():
+        return True
+
+    try:
+        result = subprocess.run(
+            ["ssh", "-i", _ssh_key()] + SSH_OPTIONS + [
+                "-o", f"ControlPath={SSH_CONTROL_PATH}",
+                "-o", f"ControlPersist={SSH_CONTROL_PERSIST}",
+                "-M", "-N", "-f", f"{SERVER_USER}@{SERVER_IP}",
+            ],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL, timeout=15,
+        )
+    except subprocess.TimeoutExpired:
+        return False
+
+    if result.returncode == 0:
+        _master_open = True
+        atexit.register(close_ssh_master)
+    return _master_open
+
+
+def close_ssh_master():
+    """
+    Stop the shared master connection opened by open_ssh_master().
+
+    Another run may have picked up the master through the shared socket, so
+    it is told to stop accepting new sessions (-O stop) rather than to exit:
+    sessions already running on it finish, then the master goes away. Later
+    ssh/scp calls fall back to direct connections.
+    """
+    global _master_open
+    if not _master_open:
+        return
+    _master_open = False
+    try:
+        subprocess.run(
+            ["ssh", "-o", f"ControlPath={SSH_CONTROL_PATH}", "-O", "stop",
+             f"{SERVER_USER}@{SERVER_IP}"],
+            capture_output=True, timeout=10,
+        )
+    except subprocess.TimeoutExpired:
+        pass
 
 
 def check_prerequisites():
@@ -52,8 +173,9 @@ def check_prerequisites():
 
 
 def test_ssh_connection():
-    """Test SSH connectivity to the server."""
+    """Test SSH connectivity to the server (and open the shared connection)."""
     print(f"  Testing SSH to {SERVER_IP}...")
+    open_ssh_master()
     result = subprocess.run(
         _ssh_base() + ["echo ok"],
         capture_output=True, text=True, timeout=15,
@@ -66,13 +188,23 @@ def test_ssh_connection():
 
 
 def run_local(cmd, description=None, check=True, cwd=None):
-    """Run a local command with logging."""
+    """Run a local command (argv list, or a string to split) with logging."""
     if description:
         print(f"  {description}...")
 
-    result = subprocess.run(
-        cmd, shell=True, capture_output=True, text=True, cwd=cwd,
-    )
+    if isinstance(cmd, str):
+        cmd = shlex.split(cmd)
+    # Resolve the executable ourselves so wrappers like npm.cmd work on Windows
+    cmd = [shutil.which(cmd[0]) or cmd[0]] + list(cmd[1:])
+
+    try:
+        result = subprocess.run(
+            cmd, capture_output=True, text=True, cwd=cwd,
+        )
+    except FileNotFoundError:
+        result = subprocess.CompletedProcess(
+            cmd, 127, "", f"{cmd[0]}: command not found",
+        )
 
     if result.returncode != 0:
         if description:
@@ -90,10 +222,11 @@ def run_ssh(remote_cmd, description=None, check=True):
     if description:
         print(f"  {description}...")
 
-    result = subprocess.run(
-        _ssh_base() + [remote_cmd],
-        capture_output=True, text=True, timeout=120,
-    )
+    with _ssh_slots:
+        result = subprocess.run(
+            _ssh_base() + [remote_cmd],
+            capture_output=True, text=True, timeout=120,
+        )
 
     if result.stdout.strip():
         print(result.stdout.strip())
@@ -109,143 +242,338 @@ def run_ssh(remote_cmd, description=None, check=True):
     return result
 
 
-def run_ssh_quiet(remote_cmd):
+def run_ssh_quiet(remote_cmd, timeout=30):
     """Run SSH command and return (stdout, stderr, returncode) without printing."""
     try:
-        result = subprocess.run(
-            _ssh_base() + [remote_cmd],
-            capture_output=True, text=True, timeout=30,
-        )
+        with _ssh_slots:
+            result = subprocess.run(
+                _ssh_base() + [remote_cmd],
+                capture_output=True, text=True, timeout=timeout,
+            )
         return result.stdout.strip(), result.stderr.strip(), result.returncode
     except subprocess.TimeoutExpired:
         return "", "SSH command timed out", 1
 
 
+def run_ssh_script(script, timeout=30):
+    """
+    Run a multi-line shell script remotely by piping it to `bash -s`.
+
+    Avoids quoting the script into a single command-line argument and has no
+    argument length limit. Returns (stdout, stderr, returncode) like
+    run_ssh_quiet().
+    """
+    try:
+        with _ssh_slots:
+            result = subprocess.run(
+                _ssh_base() + ["bash -s"],
+                input=script, capture_output=True, text=True, timeout=timeout,
+            )
+        return result.stdout.strip(), result.stderr.strip(), result.returncode
+    except subprocess.TimeoutExpired:
+        return "", "SSH script timed out", 1
+
+
+def restart_service(service, timeout=4):
+    """
+    Restart a systemd service and wait for it to come up, in one SSH call.
+
+    Polls every 0.2s until the service has stayed active for ~1s (so a
+    service that crashes right after starting is still caught) or until
+    timeout seconds pass. Returns the final `systemctl is-active` state.
+    """
+    polls = int(timeout / 0.2)
+    remote_cmd = (
+        f"sudo systemctl restart {service}; "
+        f"stable=0; for i in $(seq 1 {polls}); do "
+        f"if systemctl is-active --quiet {service}; then "
+        f"stable=$((stable + 1)); [ $stable -ge 5 ] && break; "
+        f"else stable=0; fi; sleep 0.2; done; "
+        f"systemctl is-active {service}"
+    )
+    # systemctl restart blocks through the stop phase (TimeoutStopSec is 90s
+    # by default), so allow as long as run_ssh() did plus the polling window
+    stdout, stderr, rc = run_ssh_quiet(remote_cmd, timeout=120 + timeout)
+    if stderr:
+        print(f"  stderr: {stderr}")
+    return stdout.splitlines()[-1] if stdout else ""
+
+
 def run_ssh_stream(remote_cmd):
     """Run SSH command with real-time output streaming (for logs -f)."""
+    proc = subprocess.Popen(_ssh_base() + [remote_cmd], stdout=subprocess.PIPE, bufsize=0)
+    # Chunks bypass the text layer, so write out anything printed before them
+    sys.stdout.flush()
+    out = sys.stdout.buffer
     try:
-        return subprocess.call(_ssh_base() + [remote_cmd])
+        # Unbuffered pipe: read() returns whatever has arrived, up to 4 KiB
+        for chunk in iter(lambda: proc.stdout.read(4096), b""):
+            out.write(chunk)
+            out.flush()
+        return proc.wait()
     except KeyboardInterrupt:
+        proc.terminate()
+        proc.wait()
         print("\nStopped.")
         return 0
 
 
-def _should_exclude(path, exclude_patterns):
-    """Check if a path should be excluded based on patterns."""
-    # Normalize path separators to forward slashes
-    normalized = path.replace("\\", "/")
-    parts = normalized.split("/")
+def _compile_exclusions(exclude_patterns):
+    """
+    Precompile exclude patterns for _should_exclude().
+
+    Returns (dir_names, nested_dirs, exact_names, wildcard_re): excluded
+    directory names, multi-level directory paths (e.g. "client/src"),
+    exact file names, and one regex for all wildcard patterns (or None).
+    """
+    dir_names = set()
+    nested_dirs = []
+    exact_names = set()
+    wildcards = []
 
     for pattern in exclude_patterns:
         # Directory pattern (ends with /)
         if pattern.endswith("/"):
             dir_name = pattern.rstrip("/")
-            if dir_name in parts:
-                return True
+            if "/" in dir_name:
+                nested_dirs.append(f"/{dir_name}/")
+            else:
+                dir_names.add(dir_name)
         # Wildcard pattern
         elif "*" in pattern:
-            basename = os.path.basename(path)
-            if fnmatch.fnmatch(basename, pattern):
-                return True
+            wildcards.append(fnmatch.translate(pattern))
         # Exact filename match
         else:
-            basename = os.path.basename(path)
-            if basename == pattern:
-                return True
+            exact_names.add(pattern)
+
+    wildcard_re = None
+    if wildcards:
+        # fnmatch.fnmatch() is case-insensitive where the filesystem is
+        flags = re.IGNORECASE if os.path.normcase("A") == "a" else 0
+        wildcard_re = re.compile("|".join(wildcards), flags)
+
+    return dir_names, tuple(nested_dirs), exact_names, wildcard_re
+
+
+def _should_exclude(path, exclusions):
+    """Check if a path should be excluded, given _compile_exclusions() output."""
+    dir_names, nested_dirs, exact_names, wildcard_re = exclusions
+
+    # Normalize path separators to forward slashes
+    normalized = path.replace("\\", "/")
+    parts = normalized.split("/")
+    basename = parts[-1]
 
+    if basename in exact_names or not dir_names.isdisjoint(parts):
+        return True
+    if wildcard_re is not None and wildcard_re.match(basename):
+        return True
+    if nested_dirs:
+        wrapped = f"/{normalized}/"
+        return any(d in wrapped for d in nested_dirs)
     return False
 
 
-def sync_files(local_path, remote_path, exclude_patterns, ensure_dirs=None):
+def _tar_exclude_args(exclude_patterns):
+    """Translate exclude_patterns into tar --exclude options.
+
+    tar matches unanchored, so "venv" excludes any path component named venv
+    and "*.pyc" any matching file, mirroring _should_exclude().
     """
-    Sync local files to remote server using tarfile + scp + ssh extract.
+    return [f"--exclude={pattern.rstrip('/')}" for pattern in exclude_patterns]
+
 
-    1. Create tar.gz archive locally (respecting exclusions)
-    2. SCP archive to /tmp on server
-    3. SSH to clean stale files (preserving data/venv/node_modules/db dirs)
-    4. SSH to extract archive into target directory
-    5. Ensure required directories exist (for dirs excluded from sync but needed at runtime)
-    6. Clean up archive on both ends
+def _write_archive(local_path, exclude_patterns, out):
     """
-    archive_name = f"deploy_{os.path.basename(local_path)}.tar.gz"
-    local_archive = os.path.join(tempfile.gettempdir(), archive_name)
-    remote_archive = f"/tmp/{archive_name}"
+    Write a tar.gz of local_path (respecting exclusions) to binary file out.
 
-    try:
-        # Step 1: Create tar.gz archive
-        print(f"  Creating archive from {local_path}...")
-        file_count = 0
-
-        with tarfile.open(local_archive, "w:gz") as tar:
-            for root, dirs, files in os.walk(local_path):
-                rel_root = os.path.relpath(root, local_path)
-                if rel_root == ".":
-                    rel_root = ""
-
-                # Filter directories in-place to skip excluded ones
-                dirs[:] = [
-                    d for d in dirs
-                    if not _should_exclude(
-                        os.path.join(rel_root, d) if rel_root else d,
-                        exclude_patterns,
-                    )
-                ]
-
-                for f in files:
-                    rel_path = os.path.join(rel_root, f) if rel_root else f
-                    if _should_exclude(rel_path, exclude_patterns):
-                        continue
-
-                    full_path = os.path.join(root, f)
-                    tar.add(full_path, arcname=rel_path)
-                    file_count += 1
-
-        archive_size_mb = os.path.getsize(local_archive) / (1024 * 1024)
-        print(f"  Archive: {file_count} files, {archive_size_mb:.1f} MB")
-
-        # Step 2: SCP archive to server
-        print("  Uploading archive...")
-        result = subprocess.run(
-            _scp_base() + [local_archive, f"{SERVER_USER}@{SERVER_IP}:{remote_archive}"],
-            capture_output=True, text=True, timeout=120,
-        )
-        if result.returncode != 0:
-            print(f"  SCP failed: {result.stderr.strip()}")
-            sys.exit(1)
+    Uses the system tar, compressed with pigz across all cores when
+    available. Falls back to Python's tarfile when tar is not installed.
+    """
+    tar_bin = shutil.which("tar")
+    if not tar_bin:
+        _write_archive_tarfile(local_path, exclude_patterns, out)
+        return
 
-        # Step 3: Clean stale files on server (preserve data dirs)
-        print("  Cleaning stale files on server...")
-        preserve_dirs = "venv data node_modules"
-        clean_cmd = (
-            f"cd {remote_path} && "
-            f"find . -maxdepth 1 -mindepth 1 "
-            + " ".join(f"! -name '{d}'" for d in preserve_dirs.split())
-            + " -exec rm -rf {} + 2>/dev/null; true"
+    tar_cmd = (
+        [tar_bin, "-C", str(local_path)] + _tar_exclude_args(exclude_patterns)
+    )
+    pigz_bin = shutil.which("pigz")
+    if pigz_bin:
+        tar = subprocess.Popen(
+            tar_cmd + ["-cf", "-", "."],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
         )
-        run_ssh_quiet(clean_cmd)
-
-        # Step 4: Extract archive on server
-        print("  Extracting on server...")
-        extract_cmd = (
-            f"mkdir -p {remote_path} && "
-            f"tar -xzf {remote_archive} -C {remote_path} && "
-            f"rm -f {remote_archive}"
+        pigz = subprocess.Popen([pigz_bin, "-1"], stdin=tar.stdout, stdout=out)
+        tar.stdout.close()  # pigz owns the pipe now
+        tar_stderr = tar.stderr.read()
+        tar.wait()
+        pigz.wait()
+        rc = tar.returncode or pigz.returncode
+    else:
+        tar = subprocess.run(
+            tar_cmd + ["-czf", "-", "."], stdout=out, stderr=subprocess.PIPE,
         )
-        stdout, stderr, rc = run_ssh_quiet(extract_cmd)
-        if rc != 0:
-            print(f"  Extract failed: {stderr}")
+        tar_stderr = tar.stderr
+        rc = tar.returncode
+
+    if rc != 0:
+        print(f"  Archive failed: {tar_stderr.decode(errors='replace').strip()}")
+        sys.exit(1)
+
+
+def _write_archive_tarfile(local_path, exclude_patterns, out):
+    """Fallback for _write_archive() using tarfile when tar is unavailable."""
+    exclusions = _compile_exclusions(exclude_patterns)
+    with tarfile.open(fileobj=out, mode="w|gz") as tar:
+        for full_path, rel_path in _iter_archive_files(local_path, "", exclusions):
+            tar.add(full_path, arcname=rel_path)
+
+
+def _iter_archive_files(dir_path, rel_dir, exclusions):
+    """
+    Yield (full_path, rel_path) for files under dir_path, skipping exclusions.
+
+    Uses os.scandir so directory checks come from the cached d_type instead
+    of a stat per entry; excluded directories are never scanned.
+    """
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if _should_exclude(rel_path, exclusions):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_archive_files(entry.path, rel_path, exclusions)
+            else:
+                yield entry.path, rel_path
+
+
+def sync_files(local_path, remote_path, exclude_patterns, ensure_dirs=None):
+    """
+    Sync local files to remote server by sending a tar.gz over one SSH call.
+
+    On the server, a single remote command:
+    1. Extracts the tar.gz sent from here into a staging dir next to remote_path
+    2. Only if that succeeded, cleans stale files (preserving data/venv/node_modules
+       dirs) and copies the staged files into place
+    3. Ensures required directories exist (for dirs excluded from sync but needed at runtime)
+
+    The archive is built into a local temp file first, so a failed or
+    interrupted archive never reaches the server.
+    """
+    # tar --recursive-unlink can't replace the clean step: the archive's "./"
+    # entry would make it wipe the preserved data/venv dirs too.
+    preserve_dirs = "venv data node_modules"
+    clean_cmd = (
+        "{ find . -maxdepth 1 -mindepth 1 "
+        + " ".join(f"! -name '{d}'" for d in preserve_dirs.split())
+        + " -exec rm -rf {} + 2>/dev/null; true; }"
+    )
+    # A truncated or corrupt upload fails in staging and leaves the app as it was
+    extract_cmd = (
+        f"mkdir -p {remote_path} && "
+        f"tmp=$(mktemp -d {remote_path.rstrip('/')}.sync-XXXXXX) && "
+        f"trap 'rm -rf \"$tmp\"' EXIT && "
+        f"tar -xzf - -C \"$tmp\" && "
+        # cp -a copies the staging dir's own mode onto the app root; keep the root's
+        f"chmod --reference={remote_path} \"$tmp\" && "
+        f"cd {remote_path} && {clean_cmd} && cp -a \"$tmp/.\" {remote_path}/"
+    )
+    for d in ensure_dirs or []:
+        extract_cmd += f" && mkdir -p {remote_path}/{d}"
+
+    print(f"  Creating archive of {local_path}...")
+    with tempfile.TemporaryFile() as archive, tempfile.TemporaryFile() as stderr:
+        # Exits before the server is touched if the archive can't be built
+        _write_archive(local_path, exclude_patterns, archive)
+        archive.seek(0)
+
+        print("  Uploading archive (cleaning stale files on server)...")
+        # stderr goes to a file so a chatty remote tar can't fill a pipe and stall
+        try:
+            with _ssh_slots:
+                result = subprocess.run(
+                    _ssh_base() + [extract_cmd],
+                    stdin=archive, stdout=subprocess.DEVNULL, stderr=stderr,
+                    timeout=120,
+                )
+        except subprocess.TimeoutExpired:
+            print("  Extract failed: upload timed out")
             sys.exit(1)
 
-        # Step 5: Ensure required directories exist
-        if ensure_dirs:
-            dirs_cmd = " && ".join(
-                f"mkdir -p {remote_path}/{d}" for d in ensure_dirs
-            )
-            run_ssh_quiet(dirs_cmd)
+        if result.returncode != 0:
+            stderr.seek(0)
+            print(f"  Extract failed: {stderr.read().decode(errors='replace').strip()}")
+            sys.exit(1)
+
+    print("  Sync complete")
+
+
+class _ThreadBufferedStdout:
+    """stdout wrapper that sends writes to the current thread's buffer, if any."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        buffer = getattr(_thread_output, "buffer", None)
+        return (buffer or self._stream).write(text)
+
+    def flush(self):
+        if getattr(_thread_output, "buffer", None) is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
 
-        print("  Sync complete")
 
+def run_parallel(func, app_names, *args, action="processing"):
+    """
+    Run func(name, *args) for each app concurrently.
+
+    Each app's printed output is buffered and written as one block when the
+    app finishes, so concurrent apps don't interleave. Returns a dict of
+    {app_name: result} in app_names order; apps that raise are reported and
+    recorded as False.
+    """
+    def run_one(name):
+        try:
+            return func(name, *args)
+        except SystemExit:
+            print(f"\n  ERROR {action} {name}: aborted")
+            return False
+        except Exception as e:
+            print(f"\n  ERROR {action} {name}: {e}")
+            return False
+
+    if len(app_names) <= 1:
+        return {name: run_one(name) for name in app_names}
+
+    def run_buffered(name):
+        _thread_output.buffer = io.StringIO()
+        try:
+            return run_one(name)
+        finally:
+            output = _thread_output.buffer.getvalue()
+            _thread_output.buffer = None
+            with _output_lock:
+                real_stdout.write(output)
+                real_stdout.flush()
+
+    real_stdout = sys.stdout
+    sys.stdout = _ThreadBufferedStdout(real_stdout)
+    # Indexed slots, filled in whatever order apps finish
+    results = [False] * len(app_names)
+    try:
+        workers = min(MAX_PARALLEL_APPS, len(app_names))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(run_buffered, name): i
+                for i, name in enumerate(app_names)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
     finally:
-        # Clean up local archive
-        if os.path.exists(local_archive):
-            os.remove(local_archive)
+        sys.stdout = real_stdout
+
+    return dict(zip(app_names, results))
@@ -4,83 +4,286 @@ Check service status, ports, processes, and HTTP health for all apps.
 
 Usage:
     python status.py <app|all>
+    python status.py <app|all> --ttl 10    Reuse probe results up to 10s old
+    python status.py <app|all> -v          Show recent logs for healthy apps too
+    python status.py <app|all> --json      Print per-app check results as JSON instead of a report
 """
 
+import json
+import os
+import re
 import sys
+import time
 
-from config import get_app_names, get_app_config
-from ssh_utils import check_prerequisites, test_ssh_connection, run_ssh_quiet
+from config import get_app_names, get_app_config, STATUS_CACHE_FILE
+from ssh_utils import check_prerequisites, test_ssh_connection, run_ssh_script
 
 
-def check_app_status(app_name):
-    """Run all health checks for a single app. Returns True if all pass."""
+# Right-aligned status labels, indexed by a check's bool result
+_STATUS = (f"{'[FAIL]':>8}", f"{'[OK]':>8}")
+
+# Marks the start of each probe's output in a batched probe script
+_SENTINEL_RE = re.compile(r"^---DM-PROBE-([\w:]+)---$", re.MULTILINE)
+
+
+def load_probe_cache():
+    """Load cached probe results ({key: [fetched_at, stdout]}) from disk."""
+    try:
+        with open(STATUS_CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_probe_cache(cache):
+    """
+    Write cached probe results to disk.
+
+    The cache holds the server's process list (command lines can carry
+    secrets), so it is readable by the owner only.
+    """
+    os.makedirs(os.path.dirname(STATUS_CACHE_FILE), mode=0o700, exist_ok=True)
+    fd = os.open(STATUS_CACHE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # Tighten caches written before this mode was set
+    os.chmod(STATUS_CACHE_FILE, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(cache, f)
+
+
+def _is_fresh(cache, key, ttl):
+    """Check whether a cache entry exists and is younger than ttl seconds."""
+    entry = cache.get(key) if cache is not None else None
+    return entry is not None and time.time() - entry[0] < ttl
+
+
+def run_probes(probes, cache=None, ttl=0):
+    """
+    Run several shell snippets as one script piped over a single SSH call.
+
+    probes maps probe_id -> shell command, with ids namespaced like
+    "host:ps" or "tifootball:http". Each command's output is preceded by a
+    sentinel line so it can be split back out. Returns {probe_id: stdout},
+    or None (after printing the SSH error) if the call produced no output.
+
+    Probes run concurrently on the server, so one slow command (e.g. curl
+    against a hung app) doesn't eat the time budget of all the others.
+
+    With a cache dict and ttl > 0, probes cached less than ttl seconds ago
+    are reused instead of being run again.
+    """
+    results = {}
+    if cache is not None and ttl > 0:
+        for probe_id in list(probes):
+            if _is_fresh(cache, probe_id, ttl):
+                results[probe_id] = cache[probe_id][1]
+        probes = {k: v for k, v in probes.items() if k not in results}
+        if not probes:
+            return results
+
+    # Each probe writes to its own file in the background; outputs are printed
+    # in order once all have finished. The leading echo keeps each sentinel on
+    # its own line after output with no trailing newline.
+    ids = list(probes)
+    script = "\n".join(
+        ['d=$(mktemp -d); trap \'rm -rf "$d"\' EXIT']
+        + [f'{{ {probes[probe_id]}; }} >"$d/{i}" &' for i, probe_id in enumerate(ids)]
+        + ["wait"]
+        + [f"echo; echo '---DM-PROBE-{probe_id}---'; cat \"$d/{i}\""
+           for i, probe_id in enumerate(ids)]
+    )
+    stdout, stderr, rc = run_ssh_script(script)
+    # Stamped after the call, so SSH latency doesn't count against freshness
+    fetched_at = time.time()
+
+    parts = _SENTINEL_RE.split(stdout)
+    if len(parts) == 1:
+        print(f"\n  Status probes FAILED: {stderr or f'ssh exited with {rc}'}")
+        return None
+    fetched = dict.fromkeys(probes, "")
+    for probe_id, output in zip(parts[1::2], parts[2::2]):
+        if probe_id in fetched:
+            fetched[probe_id] = output.strip()
+
+    if cache is not None:
+        for probe_id, output in fetched.items():
+            cache[probe_id] = [fetched_at, output]
+
+    results.update(fetched)
+    return results
+
+
+def host_probes(ports):
+    """
+    Probes shared by all app checks: the process table and which of ports
+    are listening. Returns {probe_id: shell command}.
+    """
+    # Let the kernel filter sockets to the ports we check
+    ports = sorted(str(port) for port in ports)
+    port_filter = " or ".join(f"sport = :{port}" for port in ports)
+    return {
+        "host:ps": "ps -eo pid,args --no-headers",
+        # Cache key depends on the filter
+        f"host:ss_{'_'.join(ports)}": f"ss -tlnH '( {port_filter} )' 2>/dev/null",
+    }
+
+
+def parse_host_probes(outputs):
+    """Parse host probe output into ({pid: args}, {listening ports})."""
+    ss_out = next((v for k, v in outputs.items() if k.startswith("host:ss_")), "")
+
+    processes = {}
+    for line in outputs.get("host:ps", "").splitlines():
+        fields = line.split(None, 1)
+        if len(fields) == 2:
+            processes[fields[0]] = fields[1]
+
+    # Local address is the 4th column, e.g. 0.0.0.0:5000 or [::]:5000
+    listening = set()
+    for line in ss_out.splitlines():
+        fields = line.split()
+        if len(fields) >= 4:
+            listening.add(fields[3].rpartition(":")[2])
+
+    return processes, listening
+
+
+def _journal_cmd(service):
+    """Shell command for a service's last 3 log lines."""
+    # Message text only, without the "-- Logs begin at" preamble or prefixes
+    return f"sudo journalctl -u {service} -n 3 --no-pager --quiet --output=cat 2>/dev/null"
+
+
+def app_probes(app_name, with_logs=False):
+    """
+    Status probes for a single app. Returns {probe_id: shell command}.
+
+    Recent logs are only included with with_logs; otherwise fetch_failing_logs
+    fetches them afterwards for apps that fail a check.
+    """
     config = get_app_config(app_name)
     service = config["service_name"]
     port = config["port"]
 
-    print(f"\n  {app_name} (port {port})")
-    print(f"  {'-'*40}")
+    probes = {
+        f"{app_name}:systemd": f"systemctl show {service} --property=ActiveState,MainPID",
+        # -f makes curl exit non-zero on HTTP errors; its exit code decides
+        f"{app_name}:http": (
+            f"curl -fsS -o /dev/null --max-time 5 -w '%{{http_code}}' "
+            f"http://localhost:{port}/ 2>/dev/null; echo \" rc=$?\""
+        ),
+    }
+    if with_logs:
+        probes[f"{app_name}:logs"] = _journal_cmd(service)
+    return probes
 
-    all_ok = True
 
-    # 1. Service status
-    stdout, _, rc = run_ssh_quiet(f"systemctl is-active {service}")
-    ok = stdout == "active"
-    print(f"  {'[OK]' if ok else '[FAIL]':>8}  Service: {stdout or 'unknown'}")
-    if not ok:
-        all_ok = False
+def check_app_status(app_name, probes, processes, listening_ports):
+    """
+    Evaluate health checks for a single app from fetched probe output.
 
-    # 2. Port listening
-    stdout, _, rc = run_ssh_quiet(f"sudo netstat -tlnp 2>/dev/null | grep ':{port} ' || true")
-    ok = bool(stdout.strip())
-    print(f"  {'[OK]' if ok else '[FAIL]':>8}  Port {port}: {'listening' if ok else 'not listening'}")
-    if not ok:
-        all_ok = False
+    probes maps this app's probe names ("systemd", "http", ...) to output;
+    processes and listening_ports come from parse_host_probes().
+    Returns a dict of check results; "ok" is True if all pass. "logs" is
+    empty unless the logs probe was fetched (see fetch_failing_logs()).
+    """
+    config = get_app_config(app_name)
 
-    # 3. Process check (via systemd MainPID)
-    stdout, _, rc = run_ssh_quiet(
-        f"systemctl show {service} --property=MainPID"
-    )
-    pid = stdout.replace("MainPID=", "").strip()
-    ok = pid and pid != "0"
-    if ok:
-        # Get process command for display
-        cmd_out, _, _ = run_ssh_quiet(f"ps -p {pid} -o args= 2>/dev/null || true")
-        display = cmd_out.strip() if cmd_out.strip() else f"PID {pid}"
-        print(f"  {'[OK]':>8}  Process: {display}")
-    else:
-        print(f"  {'[FAIL]':>8}  Process: not running")
-        all_ok = False
+    # `systemctl show` prints one Property=value per line
+    unit = {}
+    for line in probes.get("systemd", "").splitlines():
+        prop, sep, value = line.partition("=")
+        if sep:
+            unit[prop] = value.strip()
 
-    # 4. HTTP check
-    stdout, _, rc = run_ssh_quiet(
-        f"curl -s -o /dev/null -w '%{{http_code}}' http://localhost:{port}/ --max-time 5"
+    state = unit.get("ActiveState", "")
+    pid = unit.get("MainPID", "")
+    http_code, _, curl_rc = probes.get("http", "").rpartition(" rc=")
+    status = {
+        "service": state == "active",
+        "state": state,
+        "port": str(config["port"]) in listening_ports,
+        # Process check via systemd MainPID (0 when not running)
+        "process": pid not in ("", "0"),
+        "pid": pid,
+        "command": processes.get(pid, "").strip(),
+        "http": http_code.strip(),
+        "http_ok": curl_rc == "0",
+    }
+    status["ok"] = (
+        status["service"] and status["port"] and status["process"] and status["http_ok"]
     )
-    http_code = stdout.strip().strip("'")
-    ok = http_code.startswith(("2", "3"))
-    print(f"  {'[OK]' if ok else '[FAIL]':>8}  HTTP: {http_code or 'no response'}")
-    if not ok:
-        all_ok = False
-
-    # 5. Last 3 log lines
-    stdout, _, rc = run_ssh_quiet(
-        f"sudo journalctl -u {service} -n 3 --no-pager 2>/dev/null"
-    )
-    if stdout.strip():
-        print(f"  {'':>8}  Recent logs:")
-        for line in stdout.strip().split("\n"):
-            print(f"  {'':>8}    {line.strip()}")
+    status["logs"] = _log_lines(probes.get("logs", ""))
+
+    return status
+
+
+def _log_lines(output):
+    """Split journal probe output into stripped lines."""
+    return [line.strip() for line in output.strip().splitlines()]
+
+
+def fetch_failing_logs(app_names, statuses):
+    """
+    Fill in recent logs for failing apps that weren't probed with -v.
+
+    All of them are fetched together in one more SSH round-trip.
+    """
+    probes = {
+        f"{name}:logs": _journal_cmd(get_app_config(name)["service_name"])
+        for name, status in zip(app_names, statuses)
+        if not status["ok"] and not status["logs"]
+    }
+    if not probes:
+        return
+    outputs = run_probes(probes) or {}
+    for name, status in zip(app_names, statuses):
+        if f"{name}:logs" in outputs:
+            status["logs"] = _log_lines(outputs[f"{name}:logs"])
 
-    return all_ok
+
+def print_app_status(app_name, status):
+    """Print one app's health checks from check_app_status()."""
+    port = get_app_config(app_name)["port"]
+    process = (status["command"] or f"PID {status['pid']}") if status["process"] else "not running"
+    lines = [
+        f"\n  {app_name} (port {port})",
+        f"  {'-'*40}",
+        f"  {_STATUS[status['service']]}  Service: {status['state'] or 'unknown'}",
+        f"  {_STATUS[status['port']]}  Port {port}: "
+        f"{'listening' if status['port'] else 'not listening'}",
+        f"  {_STATUS[status['process']]}  Process: {process}",
+        f"  {_STATUS[status['http_ok']]}  HTTP: {status['http'] or 'no response'}",
+    ]
+    if status["logs"]:
+        lines.append(f"  {'':>8}  Recent logs:")
+        lines.extend(f"  {'':>8}    {line}" for line in status["logs"])
+
+    # Written as one block rather than a print() per line
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python status.py <app|all>")
+        print("Usage: python status.py <app|all> [--ttl SECONDS] [-v] [--json]")
         print(f"Apps: taskschedule, sevenhabitslist, recipeshoppinglist, tifootball, all")
         sys.exit(1)
 
     app_names = get_app_names(sys.argv[1])
+    verbose = "-v" in sys.argv or "--verbose" in sys.argv
+    as_json = "--json" in sys.argv
+
+    # With --json, stdout carries only the JSON; progress and errors go to stderr
+    json_out = sys.stdout
+    if as_json:
+        sys.stdout = sys.stderr
+
+    # --ttl SECONDS: reuse cached probe results (for dashboards/pollers)
+    ttl = 0
+    if "--ttl" in sys.argv:
+        i = sys.argv.index("--ttl")
+        if i + 1 < len(sys.argv):
+            ttl = float(sys.argv[i + 1])
+    cache = load_probe_cache() if ttl > 0 else None
 
     print("Deployment Manager - Status Check")
     print("=" * 40)
@@ -88,26 +291,53 @@ def main():
     print("\n[Prerequisites]")
     if not check_prerequisites():
         sys.exit(1)
-    if not test_ssh_connection():
+    if _is_fresh(cache, "host:ssh", ttl):
+        print("  SSH connection OK (cached)")
+    elif test_ssh_connection():
+        if cache is not None:
+            cache["host:ssh"] = [time.time(), "ok"]
+    else:
         sys.exit(1)
 
-    results = {}
+    # Every host and app probe goes out as one script in one SSH round-trip
+    ports = [get_app_config(name)["port"] for name in app_names]
+    script_probes = host_probes(ports)
     for name in app_names:
-        try:
-            results[name] = check_app_status(name)
-        except Exception as e:
-            print(f"\n  ERROR checking {name}: {e}")
-            results[name] = False
-
-    # Summary
-    print(f"\n{'='*40}")
-    print("  SUMMARY")
-    print(f"{'='*40}")
-    for name, ok in results.items():
-        print(f"  {'[OK]' if ok else '[FAIL]':>8}  {name}")
-    print()
-
-    if not all(results.values()):
+        script_probes.update(app_probes(name, verbose))
+    outputs = run_probes(script_probes, cache, ttl)
+    if outputs is None:
+        sys.exit(1)
+    if cache is not None:
+        save_probe_cache(cache)
+
+    # Split the combined output back into host and per-app probes
+    processes, listening_ports = parse_host_probes(outputs)
+    per_app = {name: {} for name in app_names}
+    for probe_id, output in outputs.items():
+        owner, _, probe = probe_id.partition(":")
+        if owner in per_app:
+            per_app[owner][probe] = output
+
+    statuses = [None] * len(app_names)
+    for i, name in enumerate(app_names):
+        statuses[i] = check_app_status(
+            name, per_app[name], processes, listening_ports,
+        )
+    fetch_failing_logs(app_names, statuses)
+    results = [status["ok"] for status in statuses]
+
+    if as_json:
+        # Machine-readable results only; no per-check report or summary
+        json_out.write(json.dumps(dict(zip(app_names, statuses))) + "\n")
+    else:
+        for name, status in zip(app_names, statuses):
+            print_app_status(name, status)
+
+        # Summary
+        summary = "\n".join(f"  {_STATUS[ok]}  {name}" for name, ok in zip(app_names, results))
+        print(f"\n{'='*40}\n  SUMMARY\n{'='*40}\n{summary}\n")
+
+    if not all(results):
         sys.exit(1)
 
 